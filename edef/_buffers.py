@@ -0,0 +1,46 @@
+"""_buffers.py - Helpers shared by EventDefinition and BSABuffer for reading buffers.
+"""
+
+import numpy as np
+
+def stack_buffers(pv_list, buff_list, n_measurements, dtype=None):
+    """Copies a list of buffers into a single 2D array, one row per PV.
+
+    Rows are n_measurements long, or as long as the longest buffer for a
+    rolling buffer (n_measurements <= 0).  A PV that didn't connect (None in
+    buff_list), or a buffer shorter than a row, is padded with NaN.
+
+    Args:
+        pv_list (list of str): The PVs the buffers were read for.  Only used
+              in error messages.
+        buff_list (list of numpy.ndarray): The buffers, as returned by
+              epics.caget_many.  Entries may be None.
+        n_measurements (int): The number of measurements in the acquisition.
+        dtype (numpy.dtype, optional): The data type of the array.  Defaults to
+              the common type of the buffers that arrived, promoted to a
+              floating point type if any row needs padding.
+    Returns:
+        numpy.ndarray: An array with one row per PV in pv_list.
+    """
+    arrived = [buff for buff in buff_list if buff is not None]
+    if n_measurements > 0:
+        n_points = n_measurements
+    else:
+        n_points = max([len(buff) for buff in arrived] + [0])
+    incomplete = [a_pv for a_pv, buff in zip(pv_list, buff_list) if buff is None or len(buff) < n_points]
+    if dtype is None:
+        dtype = np.result_type(*[buff.dtype for buff in arrived]) if len(arrived) > 0 else np.float64
+        if len(incomplete) > 0:
+            dtype = np.promote_types(dtype, np.float32)
+    elif len(incomplete) > 0 and not np.issubdtype(dtype, np.inexact):
+        raise Exception("Buffers for {pvs} are missing or short, and can't be padded with NaN in a {dtype} array.".format(pvs=", ".join(incomplete), dtype=np.dtype(dtype).name))
+    out = np.empty((len(buff_list), n_points), dtype=dtype)
+    for i, buff in enumerate(buff_list):
+        if buff is None:
+            out[i] = np.nan
+            continue
+        n_copied = min(len(buff), n_points)
+        out[i, 0:n_copied] = buff[0:n_copied]
+        if n_copied < n_points:
+            out[i, n_copied:] = np.nan
+    return out
@@ -4,13 +4,35 @@ Author: Matt Gibbs (mgibbs@slac.stanford.edu)
 
 import sys
 import epics
+import numpy as np
 import os
 import time
+import threading
+import logging
 from functools import partial
 from contextlib import contextmanager
+from ._buffers import stack_buffers
 
 NUM_MASK_BITS = 140
 
+#Library logger: no handlers are installed here, callers opt in through their logging config.
+logger = logging.getLogger(__name__)
+
+if sys.version_info[0] == 2:
+    STRING_TYPES = (str, unicode)
+else:
+    STRING_TYPES = (str,)
+
+# (data area substring, system, accelerator).  get_system returns the first match,
+# so more specific substrings must come first ('lcls2' before 'lcls').
+SYSTEMS = (('acctest', None, 'ACCTEST'),
+           ('spear', 'SYS5', 'SPEAR'),
+           ('nlcta', 'SYS4', 'NLCTA'),
+           ('lcls2', 'SYS2', 'LCLS2'),
+           ('facet', 'SYS1', 'FACET'),
+           ('lcls', 'SYS0', 'LCLS'))
+_system = None
+
 def get_system():
     """Gets the accelerator you are currently running on (LCLS, FACET, LCLS2, NLCTA, etc).
     
@@ -20,49 +42,52 @@ def get_system():
         A tuple (sys, accelerator) containing the system string ('SYS0' for LCLS, for example), 
         and the accelerator string ('LCLS' for LCLS, for example.)
     """
-    data_area = os.getenv('MATLABDATAFILES')
-    if 'lcls' in data_area:
-        sys = 'SYS0'
-        accelerator = 'LCLS'
-    if 'facet' in data_area:
-        sys = 'SYS1'
-        accelerator = 'FACET'
-    if 'lcls2' in data_area:
-        sys = 'SYS2'
-        accelerator = 'LCLS2'
-    if 'nlcta' in data_area:
-        sys = 'SYS4'
-        accelerator = 'NLCTA'
-    if 'spear' in data_area:
-        sys = 'SYS5'
-        accelerator = 'SPEAR'
-    if 'acctest' in data_area:
-        sys = None
-        accelerator = 'ACCTEST'
-    return (sys, accelerator)
+    global _system
+    #MATLABDATAFILES doesn't change while we run, so only look the system up once.
+    if _system is None:
+        data_area = os.getenv('MATLABDATAFILES')
+        for (area, sys, accelerator) in SYSTEMS:
+            if area in data_area:
+                _system = (sys, accelerator)
+                break
+        else:
+            raise Exception("Could not determine the accelerator from MATLABDATAFILES.")
+    return _system
 
 """EventDefinition is a class that represents an event definition.
 Instantiate an EventDefinition to reserve an edef.  Configure it,
-then start data aquisition with the 'start' method."""
+then start data aquisition with the 'start' method.
+Pass callback_min_interval (in seconds) to limit how often the avg, measurements,
+ctrl and beamcode callbacks fire.  When it is > 0, those callbacks can run on a
+threading.Timer thread instead of the CA callback thread."""
 class EventDefinition(object):
-    def __init__(self, name, user=None, edef_number=None, avg=1, measurements=-1, inclusion_masks=None, exclusion_masks=None, beamcode=None, avg_callback=None, measurements_callback=None, ctrl_callback=None, beamcode_callback=None):
+    def __init__(self, name, user=None, edef_number=None, avg=1, measurements=-1, inclusion_masks=None, exclusion_masks=None, beamcode=None, avg_callback=None, measurements_callback=None, ctrl_callback=None, beamcode_callback=None, callback_min_interval=0):
         (self.sys, self.accelerator) = get_system()
         self.ioc_location = self.sys
         if self.accelerator == 'LCLS':
             self.ioc_location = 'IN20'
         if edef_number is None:
             self.edef_num = self.reserve_edef(name, self.sys, self.accelerator, user=user)
-            print("Reserved EDEF {}".format(self.edef_num))
+            logger.debug("Reserved EDEF %s", self.edef_num)
         else:
             self.edef_num = edef_number
-        self.n_avg_pv = epics.PV("EDEF:{sys}:{num}:AVGCNT".format(sys=self.sys, num=self.edef_num))
-        self.beamcode_pv = epics.PV("EDEF:{sys}:{num}:BEAMCODE".format(sys=self.sys, num=self.edef_num))
-        self.n_measurements_pv = epics.PV("EDEF:{sys}:{num}:MEASCNT".format(sys=self.sys, num=self.edef_num))
-        self.ctrl_pv = epics.PV("EDEF:{sys}:{num}:CTRL".format(sys=self.sys, num=self.edef_num))
-        self.num_to_acquire_pv = epics.PV("EDEF:{sys}:{num}:CNTMAX".format(sys=self.sys, num=self.edef_num))
-        self.num_acquired_pv = epics.PV("EDEF:{sys}:{num}:CNT".format(sys=self.sys, num=self.edef_num))
+        # Build the PV names for this edef once, rather than on every access.
+        self._pv_prefix = "EDEF:{sys}:{num}:".format(sys=self.sys, num=self.edef_num)
+        self._mask_pvs = {mask_type: {n: self._pv_prefix + mask_type + str(n) for n in range(1, 6)} for mask_type in ("INCLUSION", "EXCLUSION")}
+        self.n_avg_pv = epics.get_pv(self._pv_prefix + "AVGCNT", connect=False)
+        self.beamcode_pv = epics.get_pv(self._pv_prefix + "BEAMCODE", connect=False)
+        self.n_measurements_pv = epics.get_pv(self._pv_prefix + "MEASCNT", connect=False)
+        self.ctrl_pv = epics.get_pv(self._pv_prefix + "CTRL", connect=False)
+        self.num_to_acquire_pv = epics.get_pv(self._pv_prefix + "CNTMAX", connect=False)
+        self.num_acquired_pv = epics.get_pv(self._pv_prefix + "CNT", connect=False)
+        #FREE is only ever written, so it doesn't need a monitor.
+        self._free_pv = epics.get_pv(self._pv_prefix + "FREE", connect=False, auto_monitor=False)
+        #Let all the connection searches go out together, instead of waiting for each PV in turn.
+        epics.ca.poll()
+        self._buffer_suffixes = {suffix: suffix + str(self.edef_num) for suffix in ('HST', 'RMSHST')}
         self.bit_mask_name_cache = {}
         self.bit_mask_reverse_cache = {}
+        self.bit_names = []
         if edef_number is None:
             #We only change the configuration of the edef if it is a brand new one.
             self.n_avg = avg
@@ -74,6 +99,13 @@ class EventDefinition(object):
             if beamcode is not None:
                 self.beamcode = beamcode
         # Now that we've set initial values for PVs, we can install callbacks.
+        # If callback_min_interval is > 0, user callbacks fire at most once per
+        # interval (in seconds), with the latest value.  Updates in between are coalesced.
+        self.callback_min_interval = callback_min_interval
+        self._throttle_lock = threading.Lock()
+        self._latest_values = {}
+        self._last_delivery = {}
+        self._pending_deliveries = {}
         self._avg_callback = None
         self._avg_callback_index = None
         if avg_callback is not None:
@@ -92,18 +124,25 @@ class EventDefinition(object):
             self.ctrl_callback = ctrl_callback
 
     def reserve_edef(self, name, sys, accelerator, user=None):
-        epics.caput("IOC:{iocloc}:EV01:EDEFNAME".format(iocloc=self.ioc_location), name, wait=True)
         timeout = 5.0
-        time_elapsed = 0.0
-        while time_elapsed < timeout:
-            for num in range(1,16):
-                edef_name = epics.caget("EDEF:{sys}:{num}:NAME".format(sys=sys, num=num))
-                if edef_name == name:
-                    if user is not None:
-                        epics.caput("EDEF:{sys}:{num}:USERNAME".format(sys=sys, num=num), str(user))
-                    return num
-            time.sleep(0.05)
-            time_elapsed += 0.05
+        edef_nums = range(1,16)
+        name_pvs = [epics.get_pv("EDEF:{sys}:{num}:NAME".format(sys=sys, num=num), connect=False) for num in edef_nums]
+        #Watch every edef's name before asking for a new one, so we find out
+        #as soon as the IOC assigns our name to an edef, instead of polling.
+        reserved = threading.Event()
+        reserved_num = []
+        callback_indices = [pv.add_callback(partial(self._reserve_name_callback, name, num, reserved, reserved_num)) for num, pv in zip(edef_nums, name_pvs)]
+        try:
+            epics.caput("IOC:{iocloc}:EV01:EDEFNAME".format(iocloc=self.ioc_location), name, wait=True)
+            reserved.wait(timeout)
+        finally:
+            for pv, index in zip(name_pvs, callback_indices):
+                pv.remove_callback(index)
+        if len(reserved_num) > 0:
+            num = reserved_num[0]
+            if user is not None:
+                epics.caput("EDEF:{sys}:{num}:USERNAME".format(sys=sys, num=num), str(user))
+            return num
         #If you get this far, the edef wasn't reserved.
         #Check if there just aren't any EDEFs.
         edefs_remaining_pv = "IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location)
@@ -113,6 +152,11 @@ class EventDefinition(object):
         else:
             raise Exception("Could not reserve an EDEF.")
     
+    def _reserve_name_callback(self, name, num, reserved, reserved_num, value=None, **kw):
+        if value == name and not reserved.is_set():
+            reserved_num.append(num)
+            reserved.set()
+
     def is_reserved(self):
         """Checks if the edef has been reserved.
 
@@ -142,29 +186,65 @@ class EventDefinition(object):
     def ctrl_callback(self, new_callback):
         if new_callback == self._ctrl_callback:
             return
-        if self._ctrl_callback is not None:
+        #The PV callback is a single bound method that looks up the current user
+        #callback, so we only touch the PV when adding or removing the first one.
+        if self._ctrl_callback is None:
+            self._ctrl_callback_index = self.ctrl_pv.add_callback(self._dispatch_ctrl)
+        elif new_callback is None:
             self.ctrl_pv.remove_callback(self._ctrl_callback_index)
+            self._ctrl_callback_index = None
         self._ctrl_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._ctrl_callback_full, new_callback)
-            self._ctrl_callback_index = self.ctrl_pv.add_callback(full_cb)
     
-    def _ctrl_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_ctrl(self, value=None, **kw):
+        self._dispatch('_ctrl_callback', self._ctrl_callback, value)
     
+    def _dispatch(self, key, user_cb, value):
+        #key is the name of the attribute holding the user callback, for the throttled path.
+        if self.callback_min_interval > 0:
+            self._deliver(key, value)
+        elif user_cb is not None:
+            user_cb(value)
+
+    def _deliver(self, key, value):
+        #Throttled delivery.  key is the name of the attribute holding the user callback.
+        with self._throttle_lock:
+            self._latest_values[key] = value
+            if key in self._pending_deliveries:
+                #A delivery is already scheduled, and it will pick up this value.
+                return
+            wait = self._last_delivery.get(key, 0.0) + self.callback_min_interval - time.time()
+            if wait > 0:
+                timer = threading.Timer(wait, self._deliver_latest, args=(key,))
+                timer.daemon = True
+                self._pending_deliveries[key] = timer
+                timer.start()
+                return
+            self._last_delivery[key] = time.time()
+        self._call_user_callback(key, value)
+
+    def _deliver_latest(self, key):
+        with self._throttle_lock:
+            del self._pending_deliveries[key]
+            value = self._latest_values[key]
+            self._last_delivery[key] = time.time()
+        self._call_user_callback(key, value)
+
+    def _call_user_callback(self, key, value):
+        user_cb = getattr(self, key)
+        if user_cb is not None:
+            user_cb(value)
+
     @property
     def n_avg(self):
         """The number of shots to average for each measurement.
-        When setting n_avg, your value will be clipped to the upper and lower limits
-        of the edef system.
+        When setting n_avg, the IOC will clip your value to the upper and lower
+        limits of the edef system.
         """
         return self.n_avg_pv.get()
     
     @n_avg.setter
     def n_avg(self, navg):
-        lopr = self.n_avg_pv.get_ctrlvars()['lower_ctrl_limit']
-        hopr = self.n_avg_pv.get_ctrlvars()['upper_ctrl_limit']
-        self.n_avg_pv.put(min(hopr, max(lopr, navg)))
+        self.n_avg_pv.put(navg)
     
     @property
     def avg_callback(self):
@@ -182,30 +262,28 @@ class EventDefinition(object):
     def avg_callback(self, new_callback):
         if new_callback == self._avg_callback:
             return
-        if self._avg_callback is not None:
+        if self._avg_callback is None:
+            self._avg_callback_index = self.n_avg_pv.add_callback(self._dispatch_avg)
+        elif new_callback is None:
             self.n_avg_pv.remove_callback(self._avg_callback_index)
+            self._avg_callback_index = None
         self._avg_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._avg_callback_full, new_callback)
-            self._avg_callback_index = self.n_avg_pv.add_callback(full_cb)
     
-    def _avg_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_avg(self, value=None, **kw):
+        self._dispatch('_avg_callback', self._avg_callback, value)
     
     @property
     def n_measurements(self):
         """The number of measurements to take.
         A value of -1 means collect forever.
-        When setting n_measurements, your value will be clipped to the upper and lower limits
-        of the edef system.
+        When setting n_measurements, the IOC will clip your value to the upper and
+        lower limits of the edef system.
         """
         return self.n_measurements_pv.get()
 
     @n_measurements.setter
     def n_measurements(self, measurements):
-        lopr = self.n_measurements_pv.get_ctrlvars()['lower_ctrl_limit']
-        hopr = self.n_measurements_pv.get_ctrlvars()['upper_ctrl_limit']
-        self.n_measurements_pv.put(min(hopr, max(lopr, measurements)))
+        self.n_measurements_pv.put(measurements)
         
     @property
     def measurements_callback(self):
@@ -223,15 +301,15 @@ class EventDefinition(object):
     def measurements_callback(self, new_callback):
         if new_callback == self._measurements_callback:
             return
-        if self._measurements_callback is not None:
+        if self._measurements_callback is None:
+            self._measurements_callback_index = self.n_measurements_pv.add_callback(self._dispatch_measurements)
+        elif new_callback is None:
             self.n_measurements_pv.remove_callback(self._measurements_callback_index)
+            self._measurements_callback_index = None
         self._measurements_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._measurements_callback_full, new_callback)
-            self._measurements_callback_index = self.n_measurements_pv.add_callback(full_cb)
     
-    def _measurements_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_measurements(self, value=None, **kw):
+        self._dispatch('_measurements_callback', self._measurements_callback, value)
     
     @property
     def beamcode(self):
@@ -257,15 +335,15 @@ class EventDefinition(object):
     def beamcode_callback(self, new_callback):
         if new_callback == self._beamcode_callback:
             return
-        if self._beamcode_callback is not None:
+        if self._beamcode_callback is None:
+            self._beamcode_callback_index = self.beamcode_pv.add_callback(self._dispatch_beamcode)
+        elif new_callback is None:
             self.beamcode_pv.remove_callback(self._beamcode_callback_index)
+            self._beamcode_callback_index = None
         self._beamcode_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._beamcode_callback_full, new_callback)
-            self._beamcode_callback_index = self.beamcode_pv.add_callback(full_cb)
     
-    def _beamcode_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_beamcode(self, value=None, **kw):
+        self._dispatch('_beamcode_callback', self._beamcode_callback, value)
     
     @property
     def inclusion_masks(self):
@@ -284,57 +362,90 @@ class EventDefinition(object):
         self.set_masks("EXCLUSION", masks)
     
     def get_masks(self, mask_type):
-        if len(self.bit_mask_reverse_cache) == 0:
+        if len(self.bit_names) == 0:
             self.populate_bit_mask_name_cache()
         masks = []
+        bit_mask = self.get_mask_bits(mask_type) >> 32
+        #Turn the combined bit mask into a list of modifier bit names.
+        #Only visit the bits that are set, lowest first.
+        while bit_mask:
+            lowest_bit = bit_mask & -bit_mask
+            bit_num = lowest_bit.bit_length() - 1
+            if bit_num < len(self.bit_names) and self.bit_names[bit_num] is not None:
+                masks.append(self.bit_names[bit_num])
+            bit_mask ^= lowest_bit
+        return masks
+
+    def get_mask_bits(self, mask_type):
+        """Gets an inclusion or exclusion mask as a single integer.
+
+        The five modifier PVs are combined into one integer, so masks can be
+        compared and combined with ordinary bitwise operators.  The bit for a
+        modifier is at position bit_mask_name_cache[name] + 32.
+
+        Args:
+            mask_type (str): Either "INCLUSION" or "EXCLUSION".
+        Returns:
+            int: The combined bit mask.
+        """
         bit_mask = 0
         #Combine the five modifiers into a single bit mask
-        pv_template = "EDEF:{sys}:{num}:{mask_type}".format(sys=self.sys, num=self.edef_num, mask_type=mask_type)
-        pv_template += "{n}"
-        for modifier_num in (5, 4, 3, 2, 1):
-            mod_mask = int(epics.caget(pv_template.format(n=modifier_num)))
-            bit_mask = bit_mask | (mod_mask << 32*(modifier_num + 1))
-        #Turn the combined bit mask into a list of modifier bit names
-        for bit_num in self.bit_mask_reverse_cache:
-            bit_val = bit_mask & (1 << (bit_num+32))
-            if bit_val != 0:
-                masks.append(self.bit_mask_reverse_cache[bit_num])
-        return masks
+        mask_pvs = self._mask_pvs[mask_type]
+        modifier_nums = (5, 4, 3, 2, 1)
+        #Fetch all five modifiers in one batch rather than one round trip each.
+        mod_masks = epics.caget_many([mask_pvs[modifier_num] for modifier_num in modifier_nums])
+        for modifier_num, mod_mask in zip(modifier_nums, mod_masks):
+            bit_mask = bit_mask | (int(mod_mask) << 32*(modifier_num + 1))
+        return bit_mask
 
     def set_masks(self, mask_type, masks):
-        self.clear_masks(mask_type)
         if len(self.bit_mask_name_cache) == 0:
             self.populate_bit_mask_name_cache()
         bit_mask = 0
         if isinstance(masks, dict):
-            for mask, val in masks.iteritems():
+            for mask, val in masks.items():
                 bit_num = self.bit_mask_name_cache[mask]
                 bit_mask = bit_mask | (val << (bit_num + 32))
         else:
             for mask in masks:
                 bit_num = self.bit_mask_name_cache[mask]
                 bit_mask = bit_mask | (1 << (bit_num + 32))
-        #Now, break the mask up into six different modifiers!
+        #Compare against the current mask, so we only write modifiers that change.
+        changed_bits = bit_mask ^ self.get_mask_bits(mask_type)
+        #Now, break the mask up into five different modifiers!
+        mask_pvs = self._mask_pvs[mask_type]
+        pvs = []
+        mod_masks = []
         for modifier_num in (5, 4, 3, 2, 1):
-            mod_mask = bit_mask & (0xFFFFFFFF << 32*(modifier_num + 1))
-            mod_mask = mod_mask >> 32*(modifier_num + 1)
-            pv_template = "EDEF:{sys}:{num}:{mask_type}".format(sys=self.sys, num=self.edef_num, mask_type=mask_type)
-            pv_template += "{n}"
-            epics.caput(pv_template.format(n=modifier_num), mod_mask, wait=True)
-            time.sleep(0.05)
+            shift = 32*(modifier_num + 1)
+            if (changed_bits >> shift) & 0xFFFFFFFF == 0:
+                continue
+            pvs.append(mask_pvs[modifier_num])
+            mod_masks.append((bit_mask >> shift) & 0xFFFFFFFF)
+        if len(pvs) == 0:
+            return
+        #Issue all the puts at once, then wait for them all to complete.
+        epics.caput_many(pvs, mod_masks, wait='all')
 
     def clear_masks(self, mask_type):
-        pvs = ["EDEF:{sys}:{num}:{mask_type}{n}".format(sys=self.sys, num=self.edef_num, mask_type=mask_type, n=num) for num in range(1, 6)]
-        for pv in pvs:
-            epics.caput(pv, 0, wait=True)
+        pvs = list(self._mask_pvs[mask_type].values())
+        epics.caput_many(pvs, [0]*len(pvs), wait='all')
 
     def populate_bit_mask_name_cache(self):
         bit_name_pvs = ["PNBN:{sys}:{n}:NAME".format(sys=self.sys, n=n) for n in range(1, NUM_MASK_BITS + 1)]
         bit_pos_pvs = ["PNBN:{sys}:{n}:BITP".format(sys=self.sys, n=n) for n in range(1, NUM_MASK_BITS + 1)]
-        bit_names = epics.caget_many(bit_name_pvs)
-        bit_positions = epics.caget_many(bit_pos_pvs)
-        self.bit_mask_name_cache = {bit_name: bit_position for bit_name, bit_position in zip(bit_names, bit_positions)}
-        self.bit_mask_reverse_cache = {bit_position: bit_name for bit_name, bit_position in zip(bit_names, bit_positions)}
+        #Fetch the names and positions together in a single batch.
+        values = epics.caget_many(bit_name_pvs + bit_pos_pvs)
+        bit_names = values[:NUM_MASK_BITS]
+        bit_positions = values[NUM_MASK_BITS:]
+        #Skip any bits whose PVs could not be read.
+        bits = [(bit_name, bit_position) for bit_name, bit_position in zip(bit_names, bit_positions) if bit_name is not None and bit_position is not None]
+        self.bit_mask_name_cache = {bit_name: bit_position for bit_name, bit_position in bits}
+        self.bit_mask_reverse_cache = {bit_position: bit_name for bit_name, bit_position in bits}
+        #bit_names is indexed directly by bit position, with None for unused positions.
+        self.bit_names = [None] * (max([int(bit_position) for _, bit_position in bits] + [-1]) + 1)
+        for bit_name, bit_position in bits:
+            self.bit_names[int(bit_position)] = bit_name
 
     def start(self, callback=None):
         """Starts data acquisition. 
@@ -347,8 +458,7 @@ class EventDefinition(object):
             raise Exception("EDEF was not reserved, cannot acquire data.")
             return False
         if callback is not None:
-            num_to_acquire = self.num_to_acquire_pv.get()
-            full_done_cb = partial(self._done_callback, num_to_acquire, callback)
+            full_done_cb = partial(self._done_callback, callback)
             self.num_acquired_pv.add_callback(full_done_cb)
         self.ctrl_pv.put(1)
         return True
@@ -366,16 +476,47 @@ class EventDefinition(object):
         self.ctrl_pv.put(0)
         return True
 
-    def _done_callback(self, num_to_acquire, user_cb, value=None, cb_info=None, **kws):
-        if value != num_to_acquire:
+    def _done_callback(self, user_cb, value=None, cb_info=None, **kws):
+        if not self._reached_target(value):
             return
         else:
             user_cb()
             cb_info[1].remove_callback(cb_info[0])  
 
-    def wait_for_complete(self):
-        while not self.is_acquisition_complete():
-            time.sleep(0.05)
+    def _reached_target(self, num_acquired):
+        #Compare against the live CNTMAX, not a copy taken in start(): the IOC
+        #recalculates CNTMAX after n_avg or n_measurements change, and those puts
+        #don't wait.  CNTMAX is monitored, so this doesn't cost a round trip.
+        #Monitor updates can coalesce, so reaching or passing the target counts.
+        num_to_acquire = self.num_to_acquire_pv.get()
+        if num_to_acquire is None or num_acquired is None or num_to_acquire <= 0:
+            return False
+        return num_acquired >= num_to_acquire
+
+    def _progress_callback(self, done, value=None, **kw):
+        if self._reached_target(value):
+            done.set()
+
+    def wait_for_complete(self, timeout=None):
+        """Blocks until the edef is done collecting data.
+        Waits on a monitor of the edef's CNT PV, rather than polling.
+
+        Args:
+            timeout (float, optional): The maximum time to wait, in seconds.
+                  If None (the default), waits forever.
+        Returns:
+            bool: True if acquisition is complete, False if the timeout expired.
+        """
+        #Only watch CNT while someone is waiting, so the shared PV doesn't collect
+        #a callback (and a reference to this object) for every EventDefinition.
+        done = threading.Event()
+        index = self.num_acquired_pv.add_callback(partial(self._progress_callback, done))
+        try:
+            if self._reached_target(self.num_acquired_pv.get()):
+                return True
+            return done.wait(timeout)
+        finally:
+            self.num_acquired_pv.remove_callback(index)
 
     def is_acquisition_complete(self):
         """Checks if the edef is done collecting data.
@@ -387,33 +528,63 @@ class EventDefinition(object):
         """
         if not self.is_reserved():
             raise Exception("EDEF was not reserved, could not acquire data.")
-        num_to_acquire = self.num_to_acquire_pv.get()
-        num_acquired = self.num_acquired_pv.get()
-        return num_acquired == num_to_acquire
+        #Use the same rule as the completion wait, so a CNT update that skips
+        #past the target still counts as complete.
+        return self._reached_target(self.num_acquired_pv.get())
+
+    def _buffer_suffix(self, suffix):
+        if suffix not in self._buffer_suffixes:
+            self._buffer_suffixes[suffix] = suffix + str(self.edef_num)
+        return self._buffer_suffixes[suffix]
 
     def buffer_pv(self, pv, suffix='HST'):
-        return "{pv}{suffix}{num}".format(pv=pv, suffix=suffix, num=self.edef_num)
+        return pv + self._buffer_suffix(suffix)
 
     def get_buffer(self, pv, suffix='HST'):
-        string_types = (str)
-        if sys.version_info[0] == 2:
-            string_types = (str, unicode)
-        if isinstance(pv, string_types):
+        #Read the measurement count once per call.  n_measurements_pv is monitored,
+        #so this is served from the local monitor cache.
+        n_measurements = self.n_measurements_pv.get()
+        if isinstance(pv, STRING_TYPES):
             buff = epics.caget(self.buffer_pv(pv=pv, suffix=suffix))
-            if self.n_measurements > 0:
+            if n_measurements > 0:
                 #If this isn't a rolling buffer, trim it to only include the collected data.
-                buff = buff[0:self.n_measurements]
+                buff = buff[0:n_measurements]
             return buff
         else:
-            pv_list = [self.buffer_pv(pv=a_pv, suffix=suffix) for a_pv in pv]
-            suffix_length = len(suffix + str(self.edef_num))
-            buff_list = epics.caget_many(pv_list)
-            buff_dict = dict(zip(pv_list, buff_list))
-            if self.n_measurements > 0:
-                buff_dict = {a_pv[:-suffix_length]: buff_dict[a_pv][0:self.n_measurements] for a_pv in buff_dict}
+            pv = list(pv)
+            buffer_suffix = self._buffer_suffix(suffix)
+            buff_list = epics.caget_many([a_pv + buffer_suffix for a_pv in pv])
+            #The keys are just the PVs we were given, so there's no suffix to strip.
+            if n_measurements > 0:
+                #Slicing a numpy array gives a view, so this doesn't copy the buffers.
+                #caget_many gives None for PVs that didn't connect; pass those through as-is.
+                return {a_pv: (buff[0:n_measurements] if buff is not None else None) for a_pv, buff in zip(pv, buff_list)}
             else:
-                buff_dict = {a_pv[:-suffix_length]: buff_dict[a_pv] for a_pv in buff_dict}
-            return buff_dict
+                return dict(zip(pv, buff_list))
+
+    def get_buffer_matrix(self, pv_list, suffix='HST', dtype=None):
+        """Gets the buffers for a list of PVs as a single 2D array.
+
+        Each row holds the buffer for the matching PV in pv_list.  The array is
+        allocated once, and each buffer is trimmed to n_measurements as it is
+        copied in, so only the collected data is copied.  Rows for PVs that
+        didn't connect, or whose buffers are short, are padded with NaN.
+        
+        Args:
+            pv_list (list of str): BSA-capable PVs (for example, "GDET:FEE:241:ENRC").
+                  All BSA system suffixes, like "HSTBR" should be left off.
+            suffix (str, optional): The buffer suffix to read.  Defaults to 'HST'.
+            dtype (numpy.dtype, optional): The data type of the array.  Defaults to
+                  the common type of the buffers.  Use numpy.float32 to halve the
+                  size of the array, if you don't need double precision.
+        Returns:
+            numpy.ndarray: An array with one row per PV in pv_list.
+        """
+        pv_list = list(pv_list)
+        n_measurements = self.n_measurements_pv.get()
+        buffer_suffix = self._buffer_suffix(suffix)
+        buff_list = epics.caget_many([a_pv + buffer_suffix for a_pv in pv_list], as_numpy=True)
+        return stack_buffers(pv_list, buff_list, n_measurements, dtype=dtype)
 
     def get_data_buffer(self, pv):
         """Gets the collected data for an edef measurement (or the current value of the
@@ -457,16 +628,16 @@ class EventDefinition(object):
         Returns:
             The latest value of the pv.
         """
-        string_types = (str)
-        if sys.version_info[0] == 2:
-            string_types = (str, unicode)
-        if isinstance(pv, string_types):
-            return epics.caget("{pv}{num}".format(pv=pv, num=self.edef_num))
+        if isinstance(pv, STRING_TYPES):
+            #get_pv reuses pyepics' own connected PV on repeated calls.  Don't monitor
+            #it, since this is a one-off read of a fast-updating BSA PV.
+            return epics.get_pv("{pv}{num}".format(pv=pv, num=self.edef_num), auto_monitor=False).get()
         else:
-            pv_list = ["{a_pv}{num}".format(a_pv=a_pv, num=self.edef_num) for a_pv in pv]
-            value_list = epics.caget_many(pv_list)
-            values = dict(zip(pv_list, value_list))
-            return {a_pv[:-len(str(self.edef_num))]: values[a_pv] for a_pv in values}
+            pv = list(pv)
+            num_suffix = str(self.edef_num)
+            value_list = epics.caget_many([a_pv + num_suffix for a_pv in pv])
+            #The keys are just the PVs we were given, so there's no suffix to strip.
+            return dict(zip(pv, value_list))
 
     def num_acquired(self):
         """Gets the number of pulses (measurements * averages) acquired by the edef.
@@ -478,7 +649,7 @@ class EventDefinition(object):
         Returns:
             int: The number of pulses acquired by the edef.
         """
-        return epics.caget("EDEF:{sys}:{num}:CNT".format(sys=self.sys, num=self.edef_num))
+        return self.num_acquired_pv.get()
 
     def num_to_acquire(self):
         """Gets the number of pulses to acquire (measurements * averages) by the edef.
@@ -486,7 +657,7 @@ class EventDefinition(object):
         Returns:
             int: The number of pulses to acquire by the edef.
         """
-        return epics.caget("EDEF:{sys}:{num}:CNTMAX".format(sys=self.sys, num=self.edef_num))
+        return self.num_to_acquire_pv.get()
         
     def release(self):
         """Releases the edef.
@@ -494,7 +665,7 @@ class EventDefinition(object):
         """
         if not self.is_reserved():
             raise Exception("EDEF was not reserved, cannot release.")
-        epics.caput("EDEF:{sys}:{num}:FREE".format(sys=self.sys, num=self.edef_num), 1)
+        self._free_pv.put(1)
     
     def __enter__(self):
         return self
@@ -4,43 +4,69 @@ Author: Matt Gibbs (mgibbs@slac.stanford.edu)
 
 import sys
 import epics
+import numpy as np
 import os
-import time
-from functools import partial
+import threading
+import operator
+from functools import partial, reduce
 from contextlib import contextmanager
+from ._buffers import stack_buffers
 
 NUM_MASK_BITS = 9
 
+if sys.version_info[0] == 2:
+    STRING_TYPES = (str, unicode)
+else:
+    STRING_TYPES = (str,)
+
 """BSABuffer is a class that represents a BSA Buffer.
 Instantiate a BSABuffer object to reserve one of the buffers.  Configure it,
 then start data aquisition with the 'start' method."""
 class BSABuffer(object):
     prefix = "BSA:SYS0:1"
+    #Destination names, keyed by buffer number.  They don't change while the IOC
+    #is running, so every BSABuffer on the same buffer number shares one fetch.
+    _bit_cache_by_number = {}
     def __init__(self, name, user=None, number=None, avg=1, measurements=1000, destination_mode=None, destination_masks=None, avg_callback=None, measurements_callback=None, ctrl_callback=None):
         if number is None:
             self.number = self.reserve(name, user=user)
         else:
             self.number = number
         self.sys = "SYS0"
-        self.n_avg_pv = epics.PV("{prefix}:{num}:AVGCNT".format(prefix=self.prefix, num=self.number))
-        self.n_measurements_pv = epics.PV("{prefix}:{num}:MEASCNT".format(prefix=self.prefix, num=self.number))
-        self.ctrl_pv = epics.PV("{prefix}:{num}:CTRL".format(prefix=self.prefix, num=self.number))
-        self.num_acquired_pv = epics.PV("{prefix}:{num}:CNT".format(prefix=self.prefix, num=self.number))
-        self.rate_mode_pv = epics.PV("{prefix}:{num}:RATEMODE".format(prefix=self.prefix, num=self.number))
-        self.destination_mode_pv = epics.PV("{prefix}:{num}:DESTMODE".format(prefix=self.prefix, num=self.number))
-        self.destination_mask_pv = epics.PV("{prefix}:{num}:DESTMASK".format(prefix=self.prefix, num=self.number))
-        self.fixed_rate_pv = epics.PV("{prefix}:{num}:FIXEDRATE".format(prefix=self.prefix, num=self.number))
-        self.ac_rate_pv = epics.PV("{prefix}:{num}:ACRATE".format(prefix=self.prefix, num=self.number))
-        self.timeslot_mask_pv = epics.PV("{prefix}:{num}:TSLOTMASK".format(prefix=self.prefix, num=self.number))
-        self.measurement_severity_pv = epics.PV("{prefix}:{num}:MEASSEVR".format(prefix=self.prefix, num=self.number))
+        #Every PV for this buffer starts with the same base, so only build it once.
+        self._base = "{prefix}:{num}".format(prefix=self.prefix, num=self.number)
+        self.n_avg_pv = epics.get_pv(self._base + ":AVGCNT", connect=False)
+        #MEASCNT and CNT are read on every completion check, so always monitor them.
+        #get() then returns the latest monitored value without a network round trip.
+        self.n_measurements_pv = epics.get_pv(self._base + ":MEASCNT", connect=False, auto_monitor=True)
+        self.ctrl_pv = epics.get_pv(self._base + ":CTRL", connect=False)
+        self.num_acquired_pv = epics.get_pv(self._base + ":CNT", connect=False, auto_monitor=True)
+        #These configuration PVs are only read occasionally and never have callbacks,
+        #so don't bother subscribing to them.
+        self.rate_mode_pv = epics.get_pv(self._base + ":RATEMODE", connect=False, auto_monitor=False)
+        self.destination_mode_pv = epics.get_pv(self._base + ":DESTMODE", connect=False, auto_monitor=False)
+        self.destination_mask_pv = epics.get_pv(self._base + ":DESTMASK", connect=False, auto_monitor=False)
+        self.fixed_rate_pv = epics.get_pv(self._base + ":FIXEDRATE", connect=False, auto_monitor=False)
+        self.ac_rate_pv = epics.get_pv(self._base + ":ACRATE", connect=False, auto_monitor=False)
+        self.timeslot_mask_pv = epics.get_pv(self._base + ":TSLOTMASK", connect=False, auto_monitor=False)
+        self.measurement_severity_pv = epics.get_pv(self._base + ":MEASSEVR", connect=False, auto_monitor=False)
+        #Let all the connection searches go out together, instead of waiting for each PV in turn.
+        epics.ca.poll()
+        self._buffer_suffixes = {suffix: suffix + str(self.number) for suffix in ('HST', 'RMSHST')}
+        self._n_avg_limits = None
+        self._n_measurements_limits = None
         self.bit_mask_name_cache = {}
         self.bit_mask_reverse_cache = {}
+        self.bit_names = ()
         if number is None:
             #We only change the configuration of the edef if it is a brand new one.
-            self.n_avg = avg
-            self.n_measurements = measurements
+            #The single-PV settings all go out in one batch of puts.
+            config_pvs = [self.n_avg_pv.pvname, self.n_measurements_pv.pvname]
+            config_values = [self._clip_n_avg(avg), self._clip_n_measurements(measurements)]
             if destination_mode is not None:
-                self.destination_mode = destination_mode
+                config_pvs.append(self.destination_mode_pv.pvname)
+                config_values.append(destination_mode)
+            epics.caput_many(config_pvs, config_values, wait='all')
             if destination_masks is not None:
                 self.destination_masks = destination_masks
         # Now that we've set initial values for PVs, we can install callbacks.
@@ -66,26 +92,47 @@ class BSABuffer(object):
         return cls.num_buffers_available() > 0
 
     def reserve(self, name, user=None):
-        if not self.check_available():
-            raise Exception("No BSA buffers available.")
-        epics.caput("{prefix}:BSANAME".format(prefix=self.prefix), name, wait=True)
+        #Don't ask the IOC if any buffers are free up front: the NAME monitors below
+        #tell us when one has been assigned, and we only check NFREEBSA on failure.
         timeout = 5.0
-        time_elapsed = 0.0
-        while time_elapsed < timeout:
-            for num in range(21,50):
-                buffer_name = epics.caget("{prefix}:{num}:NAME".format(prefix=self.prefix, sys=sys, num=num))
-                if buffer_name == name:
-                    if user is not None:
-                        epics.caput("{prefix}:{num}:USERNAME".format(prefix=self.prefix, sys=sys, num=num), str(user))
-                    return num
-            time.sleep(0.05)
-            time_elapsed += 0.05
-        #If you get this far, the edef wasn't reserved.
-        #Check again if there just aren't any EDEFs.
-        if not check_available():
+        buffer_nums = range(21,50)
+        name_pvs = [epics.get_pv("{prefix}:{num}:NAME".format(prefix=self.prefix, num=num), connect=False) for num in buffer_nums]
+        #Watch every buffer's name before asking for a new one, so we find out
+        #as soon as the IOC assigns our name to a buffer, instead of polling.
+        reserved = threading.Event()
+        reserved_num = []
+        callback_indices = [pv.add_callback(partial(self._reserve_name_callback, name, num, reserved, reserved_num)) for num, pv in zip(buffer_nums, name_pvs)]
+        try:
+            #Don't block on the put completing: the NAME monitors tell us when the
+            #IOC has assigned the buffer, so waiting on them covers the put too.
+            name_request_pv = epics.get_pv("{prefix}:BSANAME".format(prefix=self.prefix))
+            name_request_pv.put(name, use_complete=True)
+            if not reserved.wait(timeout):
+                #If a monitor update went missing, one batched read of every name
+                #still finds the buffer, without going back to polling.
+                for num, buffer_name in zip(buffer_nums, epics.caget_many([pv.pvname for pv in name_pvs])):
+                    if buffer_name == name:
+                        reserved_num.append(num)
+                        break
+        finally:
+            for pv, index in zip(name_pvs, callback_indices):
+                pv.remove_callback(index)
+        if len(reserved_num) > 0:
+            num = reserved_num[0]
+            if user is not None:
+                epics.caput("{prefix}:{num}:USERNAME".format(prefix=self.prefix, num=num), str(user))
+            return num
+        #If you get this far, the buffer wasn't reserved.
+        #Check if there just aren't any buffers.
+        if not self.check_available():
             raise Exception("No BSA buffers available.")
         else:
             raise Exception("Could not reserve a BSA buffer.")
+
+    def _reserve_name_callback(self, name, num, reserved, reserved_num, value=None, **kw):
+        if value == name and not reserved.is_set():
+            reserved_num.append(num)
+            reserved.set()
     
     def is_reserved(self):
         """Checks if the buffer has been reserved.
@@ -116,15 +163,19 @@ class BSABuffer(object):
     def ctrl_callback(self, new_callback):
         if new_callback == self._ctrl_callback:
             return
-        if self._ctrl_callback is not None:
+        #The PV callback is a single bound method that looks up the current user
+        #callback, so we only touch the PV when adding or removing the first one.
+        if self._ctrl_callback is None:
+            self._ctrl_callback_index = self.ctrl_pv.add_callback(self._dispatch_ctrl)
+        elif new_callback is None:
             self.ctrl_pv.remove_callback(self._ctrl_callback_index)
+            self._ctrl_callback_index = None
         self._ctrl_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._ctrl_callback_full, new_callback)
-            self._ctrl_callback_index = self.ctrl_pv.add_callback(full_cb)
     
-    def _ctrl_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_ctrl(self, value=None, **kw):
+        user_cb = self._ctrl_callback
+        if user_cb is not None:
+            user_cb(value)
     
     @property
     def n_avg(self):
@@ -136,9 +187,20 @@ class BSABuffer(object):
     
     @n_avg.setter
     def n_avg(self, navg):
-        lopr = self.n_avg_pv.get_ctrlvars()['lower_ctrl_limit']
-        hopr = self.n_avg_pv.get_ctrlvars()['upper_ctrl_limit']
-        self.n_avg_pv.put(min(hopr, max(lopr, navg)))
+        self.n_avg_pv.put(self._clip_n_avg(navg))
+
+    def _get_limits(self, pv, cache_attr):
+        #The limits don't change during a session, so only fetch them once.
+        limits = getattr(self, cache_attr)
+        if limits is None:
+            ctrlvars = pv.get_ctrlvars()
+            limits = (ctrlvars['lower_ctrl_limit'], ctrlvars['upper_ctrl_limit'])
+            setattr(self, cache_attr, limits)
+        return limits
+
+    def _clip_n_avg(self, navg):
+        (lopr, hopr) = self._get_limits(self.n_avg_pv, '_n_avg_limits')
+        return min(hopr, max(lopr, navg))
 
     @property
     def avg_callback(self):
@@ -156,15 +218,19 @@ class BSABuffer(object):
     def avg_callback(self, new_callback):
         if new_callback == self._avg_callback:
             return
-        if self._avg_callback is not None:
+        #The PV callback is a single bound method that looks up the current user
+        #callback, so we only touch the PV when adding or removing the first one.
+        if self._avg_callback is None:
+            self._avg_callback_index = self.n_avg_pv.add_callback(self._dispatch_avg)
+        elif new_callback is None:
             self.n_avg_pv.remove_callback(self._avg_callback_index)
+            self._avg_callback_index = None
         self._avg_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._avg_callback_full, new_callback)
-            self._avg_callback_index = self.n_avg_pv.add_callback(full_cb)
     
-    def _avg_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_avg(self, value=None, **kw):
+        user_cb = self._avg_callback
+        if user_cb is not None:
+            user_cb(value)
     
     @property
     def n_measurements(self):
@@ -176,9 +242,11 @@ class BSABuffer(object):
 
     @n_measurements.setter
     def n_measurements(self, measurements):
-        lopr = self.n_measurements_pv.get_ctrlvars()['lower_ctrl_limit']
-        hopr = self.n_measurements_pv.get_ctrlvars()['upper_ctrl_limit']
-        self.n_measurements_pv.put(min(hopr, max(lopr, measurements)))
+        self.n_measurements_pv.put(self._clip_n_measurements(measurements))
+
+    def _clip_n_measurements(self, measurements):
+        (lopr, hopr) = self._get_limits(self.n_measurements_pv, '_n_measurements_limits')
+        return min(hopr, max(lopr, measurements))
         
     @property
     def measurements_callback(self):
@@ -196,15 +264,19 @@ class BSABuffer(object):
     def measurements_callback(self, new_callback):
         if new_callback == self._measurements_callback:
             return
-        if self._measurements_callback is not None:
+        #The PV callback is a single bound method that looks up the current user
+        #callback, so we only touch the PV when adding or removing the first one.
+        if self._measurements_callback is None:
+            self._measurements_callback_index = self.n_measurements_pv.add_callback(self._dispatch_measurements)
+        elif new_callback is None:
             self.n_measurements_pv.remove_callback(self._measurements_callback_index)
+            self._measurements_callback_index = None
         self._measurements_callback = new_callback
-        if new_callback is not None:
-            full_cb = partial(self._measurements_callback_full, new_callback)
-            self._measurements_callback_index = self.n_measurements_pv.add_callback(full_cb)
     
-    def _measurements_callback_full(self, user_cb, value=None, **kw):
-        user_cb(value)
+    def _dispatch_measurements(self, value=None, **kw):
+        user_cb = self._measurements_callback
+        if user_cb is not None:
+            user_cb(value)
     
     @property
     def destination_mode(self):
@@ -220,42 +292,63 @@ class BSABuffer(object):
 
     @property
     def destination_masks(self):
-        if len(self.bit_mask_reverse_cache) == 0:
-            self.populate_bit_mask_name_cache()
+        if len(self.bit_names) == 0:
+            self._load_bit_mask_name_cache()
+        bit_names = self.bit_names
         masks = []
         bit_mask = int(self.destination_mask_pv.get())
-        #Turn the combined bit mask into a list of modifier bit names
-        for bit_num in self.bit_mask_reverse_cache:
-            bit_val = bit_mask & (1 << bit_num)
-            if bit_val != 0:
-                masks.append(self.bit_mask_reverse_cache[bit_num])
+        #Turn the combined bit mask into a list of destination names.
+        #Only visit the bits that are set, lowest first.
+        while bit_mask:
+            lowest_bit = bit_mask & -bit_mask
+            bit_num = lowest_bit.bit_length() - 1
+            if bit_num < len(bit_names):
+                masks.append(bit_names[bit_num])
+            bit_mask ^= lowest_bit
         return masks
 
     @destination_masks.setter
     def destination_masks(self, masks):
-        self.clear_masks()
         if len(self.bit_mask_name_cache) == 0:
-            self.populate_bit_mask_name_cache()
-        bit_mask = 0
+            self._load_bit_mask_name_cache()
+        name_cache = self.bit_mask_name_cache
         if isinstance(masks, dict):
-            for mask, val in masks.iteritems():
-                bit_num = self.bit_mask_name_cache[mask]
-                bit_mask = bit_mask | (val << bit_num)
+            bits = (val << name_cache[mask] for mask, val in masks.items())
         else:
-            for mask in masks:
-                bit_num = self.bit_mask_name_cache[mask]
-                bit_mask = bit_mask | (1 << bit_num)
+            bits = (1 << name_cache[mask] for mask in masks)
+        bit_mask = reduce(operator.or_, bits, 0)
+        #DESTMASK holds every destination bit, so this one put replaces the whole
+        #mask.  There's no need to clear it first.
         self.destination_mask_pv.put(bit_mask)
 
     def clear_masks(self):
         self.destination_mask_pv.put(0)
 
+    def _load_bit_mask_name_cache(self):
+        #Use the names another BSABuffer already fetched for this buffer, if there are any.
+        bit_names = BSABuffer._bit_cache_by_number.get(self.number)
+        if bit_names is None:
+            self.populate_bit_mask_name_cache()
+        else:
+            self._set_bit_mask_name_cache(bit_names)
+
     def populate_bit_mask_name_cache(self):
-        bit_nums = list(range(0, NUM_MASK_BITS + 1))
-        bit_name_pvs = ["{prefix}:{num}:DST{n}.DESC".format(prefix=self.prefix, num=self.number, n=n) for n in bit_nums]
-        bit_names = epics.caget_many(bit_name_pvs)
-        self.bit_mask_name_cache = {bit_name: bit_num for bit_name, bit_num in zip(bit_names, bit_nums)}
-        self.bit_mask_reverse_cache = {bit_num: bit_name for bit_name, bit_num in zip(bit_names, bit_nums)}
+        bit_name_pvs = [self._base + ":DST" + str(n) + ".DESC" for n in range(NUM_MASK_BITS)]
+        bit_names = tuple(epics.caget_many(bit_name_pvs))
+        #Only share complete results, so a failed read gets retried next time.
+        if None not in bit_names:
+            BSABuffer._bit_cache_by_number[self.number] = bit_names
+        self._set_bit_mask_name_cache(bit_names)
+
+    def _set_bit_mask_name_cache(self, bit_names):
+        bit_nums = range(NUM_MASK_BITS)
+        self.bit_mask_name_cache = {}
+        self.bit_mask_reverse_cache = {}
+        for bit_num, bit_name in zip(bit_nums, bit_names):
+            self.bit_mask_name_cache[bit_name] = bit_num
+            self.bit_mask_reverse_cache[bit_num] = bit_name
+        #The bits are numbered from 0, so a tuple indexed by bit number maps bits to names.
+        self.bit_names = bit_names
 
     def start(self, callback=None):
         """Starts data acquisition. 
@@ -268,8 +361,7 @@ class BSABuffer(object):
             raise Exception("BSA Buffer was not reserved, cannot acquire data.")
             return False
         if callback is not None:
-            num_to_acquire = self.num_to_acquire_pv.get()
-            full_done_cb = partial(self._done_callback, num_to_acquire, callback)
+            full_done_cb = partial(self._done_callback, callback)
             self.num_acquired_pv.add_callback(full_done_cb)
         self.ctrl_pv.put(1)
         return True
@@ -287,54 +379,129 @@ class BSABuffer(object):
         self.ctrl_pv.put(0)
         return True
 
-    def _done_callback(self, num_to_acquire, user_cb, value=None, cb_info=None, **kws):
-        if value != num_to_acquire:
+    def _done_callback(self, user_cb, value=None, cb_info=None, **kws):
+        if not self._reached_target(value):
             return
         else:
             user_cb()
             cb_info[1].remove_callback(cb_info[0])  
 
-    def wait_for_complete(self):
-        while not self.is_acquisition_complete():
-            time.sleep(0.05)
+    def _reached_target(self, num_acquired):
+        #Compare against the live MEASCNT, not a copy taken in start(): the
+        #n_measurements setter doesn't wait for its put, so a copy can be stale.
+        #MEASCNT is monitored, so this doesn't cost a round trip.
+        #Monitor updates can coalesce, so reaching or passing the target counts.
+        #A rolling buffer (no positive target) never completes.
+        num_to_acquire = self.n_measurements_pv.get()
+        if num_to_acquire is None or num_acquired is None or num_to_acquire <= 0:
+            return False
+        return num_acquired >= num_to_acquire
+
+    def _progress_callback(self, done, value=None, **kw):
+        if self._reached_target(value):
+            done.set()
+
+    def wait_for_complete(self, timeout=None):
+        """Blocks until the buffer is done collecting data.
+        Waits on a monitor of the buffer's CNT PV, rather than polling.
+
+        Args:
+            timeout (float, optional): The maximum time to wait, in seconds.
+                  If None (the default), waits forever.
+        Returns:
+            bool: True if acquisition is complete, False if the timeout expired.
+        """
+        #Only watch CNT while someone is waiting, so the shared PV doesn't collect
+        #a callback (and a reference to this object) for every BSABuffer.
+        done = threading.Event()
+        index = self.num_acquired_pv.add_callback(partial(self._progress_callback, done))
+        try:
+            if self._reached_target(self.num_acquired_pv.get()):
+                return True
+            return done.wait(timeout)
+        finally:
+            self.num_acquired_pv.remove_callback(index)
 
     def is_acquisition_complete(self):
         """Checks if the buffer is done collecting data.
-        Looks to see if the "Total Acquired so far" PV matches the "Total to Acquire" PV.
-        If the two match, it is assumed that data acquisition is complete.
+        Looks to see if the "Total Acquired so far" PV has reached the "Total to Acquire" PV.
+        If it has, it is assumed that data acquisition is complete.
         Raises an exception if the buffer was not properly reserved.
         Returns:
             bool: True if acquisition is complete, False otherwise.
         """
         if not self.is_reserved():
             raise Exception("BSA Buffer was not reserved, could not acquire data.")
-        num_to_acquire = self.n_measurements_pv.get()
-        num_acquired = self.num_acquired_pv.get()
-        return num_acquired == num_to_acquire
+        #Use the same rule as the completion wait, so a CNT update that skips
+        #past the target still counts as complete.
+        return self._reached_target(self.num_acquired_pv.get())
+
+    def _buffer_suffix(self, suffix):
+        if suffix not in self._buffer_suffixes:
+            self._buffer_suffixes[suffix] = suffix + str(self.number)
+        return self._buffer_suffixes[suffix]
 
     def buffer_pv(self, pv, suffix='HST'):
-        return "{pv}{suffix}{num}".format(pv=pv, suffix=suffix, num=self.number)
+        return pv + self._buffer_suffix(suffix)
 
     def get_buffer(self, pv, suffix='HST'):
-        string_types = (str)
-        if sys.version_info[0] == 2:
-            string_types = (str, unicode)
-        if isinstance(pv, string_types):
-            buff = epics.caget(self.buffer_pv(pv=pv, suffix=suffix))
-            if self.n_measurements > 0:
+        """Gets the buffer for a PV, or a dict of buffers for a list of PVs.
+
+        This reads whatever is in the buffer right now, it doesn't wait for data.
+        Call wait_for_complete() first if you need the full acquisition: it waits
+        on a monitor of the buffer's CNT PV, so there's no polling involved.
+        
+        Args:
+            pv (str or list of str): A BSA-capable PV (for example, "GDET:FEE:241:ENRC"),
+                  or a list of them.  All BSA system suffixes, like "HSTBR" should be left off.
+            suffix (str, optional): The buffer suffix to read.  Defaults to 'HST'.
+        Returns:
+            numpy.ndarray, or a dict of numpy.ndarray keyed by PV for a list of PVs.
+        """
+        #n_measurements_pv is monitored, so this is served from the local monitor cache.
+        n_measurements = self.n_measurements_pv.get()
+        if isinstance(pv, STRING_TYPES):
+            #Ask for numpy arrays explicitly, so trimming below slices a view, not a list copy.
+            buff = epics.caget(self.buffer_pv(pv=pv, suffix=suffix), as_numpy=True)
+            if n_measurements > 0:
                 #If this isn't a rolling buffer, trim it to only include the collected data.
-                buff = buff[0:self.n_measurements]
+                buff = buff[0:n_measurements]
             return buff
         else:
-            pv_list = [self.buffer_pv(pv=a_pv, suffix=suffix) for a_pv in pv]
-            suffix_length = len(suffix + str(self.number))
-            buff_list = epics.caget_many(pv_list)
-            buff_dict = dict(zip(pv_list, buff_list))
-            if self.n_measurements > 0:
-                buff_dict = {a_pv[:-suffix_length]: buff_dict[a_pv][0:self.n_measurements] for a_pv in buff_dict}
+            pv = list(pv)
+            buffer_suffix = self._buffer_suffix(suffix)
+            buff_list = epics.caget_many([a_pv + buffer_suffix for a_pv in pv], as_numpy=True)
+            #The keys are just the PVs we were given, so there's no suffix to strip.
+            if n_measurements > 0:
+                #Slicing a numpy array gives a view, so this doesn't copy the buffers.
+                #caget_many gives None for PVs that didn't connect; pass those through as-is.
+                return {a_pv: (buff[0:n_measurements] if buff is not None else None) for a_pv, buff in zip(pv, buff_list)}
             else:
-                buff_dict = {a_pv[:-suffix_length]: buff_dict[a_pv] for a_pv in buff_dict}
-            return buff_dict
+                return dict(zip(pv, buff_list))
+
+    def get_buffer_matrix(self, pv_list, suffix='HST', dtype=None):
+        """Gets the buffers for a list of PVs as a single 2D array.
+
+        Each row holds the buffer for the matching PV in pv_list.  The array is
+        allocated once, and each buffer is trimmed to n_measurements as it is
+        copied in, so only the collected data is copied.  Rows for PVs that
+        didn't connect, or whose buffers are short, are padded with NaN.
+        
+        Args:
+            pv_list (list of str): BSA-capable PVs (for example, "GDET:FEE:241:ENRC").
+                  All BSA system suffixes, like "HSTBR" should be left off.
+            suffix (str, optional): The buffer suffix to read.  Defaults to 'HST'.
+            dtype (numpy.dtype, optional): The data type of the array.  Defaults to
+                  the common type of the buffers.  Use numpy.float32 to halve the
+                  size of the array, if you don't need double precision.
+        Returns:
+            numpy.ndarray: An array with one row per PV in pv_list.
+        """
+        pv_list = list(pv_list)
+        n_measurements = self.n_measurements_pv.get()
+        buffer_suffix = self._buffer_suffix(suffix)
+        buff_list = epics.caget_many([a_pv + buffer_suffix for a_pv in pv_list], as_numpy=True)
+        return stack_buffers(pv_list, buff_list, n_measurements, dtype=dtype)
 
     def get_data_buffer(self, pv):
         """Gets the collected data for an BSA measurement.
@@ -378,16 +545,14 @@ class BSABuffer(object):
         Returns:
             The latest value of the pv.
         """
-        string_types = (str)
-        if sys.version_info[0] == 2:
-            string_types = (str, unicode)
-        if isinstance(pv, string_types):
+        if isinstance(pv, STRING_TYPES):
             return epics.caget("{pv}{num}".format(pv=pv, num=self.number))
         else:
-            pv_list = ["{a_pv}{num}".format(a_pv=a_pv, num=self.number) for a_pv in pv]
-            value_list = epics.caget_many(pv_list)
-            values = dict(zip(pv_list, value_list))
-            return {a_pv[:-len(str(self.number))]: values[a_pv] for a_pv in values}
+            pv = list(pv)
+            num_suffix = str(self.number)
+            value_list = epics.caget_many([a_pv + num_suffix for a_pv in pv])
+            #The keys are just the PVs we were given, so there's no suffix to strip.
+            return dict(zip(pv, value_list))
 
     def num_acquired(self):
         """Gets the number of measurements acquired by the buffer.
@@ -415,7 +580,7 @@ class BSABuffer(object):
         """
         if not self.is_reserved():
             raise Exception("Buffer was not reserved, cannot release.")
-        epics.caput("{prefix}:{num}:FREE".format(prefix=self.prefix, num=self.number), 1)
+        epics.caput(self._base + ":FREE", 1)
     
     def __enter__(self):
         return self
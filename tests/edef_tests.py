@@ -1,26 +1,25 @@
 import unittest
 import edef
-import os
 import epics
-import time
-from random import randint
+from helpers import setUpModule, HOSTNAME, unique_suffix, caget_once, wait_ready, wait_for_completion, find_reserved_number
 
 class EdefReservationTest(unittest.TestCase):
 	def setUp(self):
 		(self.sys, self.accelerator) = edef.get_system()
 		if self.accelerator == 'LCLS':
 			self.ioc_location = 'IN20'
-		self.initial_edefs_available = epics.caget("IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location))
-		self.name = "edef.py unit tests {}".format(randint(0,255))
-		self.edef = edef.EventDefinition(self.name, os.uname()[1])
+		self.edefs_available_pv = "IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location)
+		self.initial_edefs_available = caget_once(self.edefs_available_pv)
+		self.name = "edef.py unit tests {}".format(unique_suffix())
+		self.edef = edef.EventDefinition(self.name, HOSTNAME)
 
 	def test_available_count_drops(self):
-		edefs_available_after_setup = epics.caget("IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location))
+		edefs_available_after_setup = caget_once(self.edefs_available_pv)
 		self.assertTrue(edefs_available_after_setup < self.initial_edefs_available)
 	
 	def test_edef_name_is_correct(self):
 		name_pv = "EDEF:{sys}:{num}:NAME".format(sys=self.edef.sys, num=self.edef.edef_num)
-		fetched_name = epics.caget(name_pv)
+		fetched_name = caget_once(name_pv)
 		self.assertEqual(self.name, fetched_name)
 
 	def tearDown(self):
@@ -36,16 +35,21 @@ class ExistingEdefTest(unittest.TestCase):
 		if self.accelerator == 'LCLS':
 			self.ioc_location = 'IN20'
 		#Reserve an edef manually
-		self.name = "edef.py unit tests {}".format(randint(0,255))
-		epics.caput("IOC:{iocloc}:EV01:EDEFNAME".format(iocloc=self.ioc_location), self.name)
+		self.name = "edef.py unit tests {}".format(unique_suffix())
+		edefs_available_pv = "IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location)
+		initial_edefs_available = caget_once(edefs_available_pv)
+		epics.caput("IOC:{iocloc}:EV01:EDEFNAME".format(iocloc=self.ioc_location), self.name, wait=True)
 		#Find the number of the edef we just reserved
-		self.edef_num = None
-		for i in range(1,16):
-			name = epics.caget("EDEF:{sys}:{num}:NAME".format(sys=self.sys, num=i))
-			if name == self.name:
-				self.edef_num = i
-				time.sleep(1.0) #Give the edef a bit of time to initialize.
-				break
+		#Read every edef's name in one batch, rather than one caget per edef.
+		edef_nums = range(1,16)
+		sys_prefix = "EDEF:{sys}:".format(sys=self.sys)
+		self.edef_num = find_reserved_number([sys_prefix + str(i) + ":NAME" for i in edef_nums], edef_nums, self.name)
+		if self.edef_num is not None:
+			self.pv_prefix = sys_prefix + str(self.edef_num) + ":"
+			#The IOC only counts the edef as taken once it has set it up, so wait for
+			#the available count to drop before using it.
+			if not wait_ready(edefs_available_pv, lambda available: available < initial_edefs_available):
+				raise RuntimeError('Manually reserved edef did not finish initializing, cannot proceed with test.')
 		if self.edef_num is None:
 			raise RuntimeError('Manual edef reservation failed, cannot proceed with test.')
 	
@@ -53,34 +57,35 @@ class ExistingEdefTest(unittest.TestCase):
 		if self.edef_num is None:
 			raise RuntimeError('Manual edef reservation failed, cannot proceed with test.')
 		num_avg = 13
-		epics.caput("EDEF:{sys}:{num}:AVGCNT".format(sys=self.sys, num=self.edef_num), num_avg)
+		epics.caput(self.pv_prefix + "AVGCNT", num_avg)
 		num_meas = 20
-		epics.caput("EDEF:{sys}:{num}:MEASCNT".format(sys=self.sys, num=self.edef_num), num_meas)
+		epics.caput(self.pv_prefix + "MEASCNT", num_meas)
 		edef_obj = edef.EventDefinition("should ignore", edef_number=self.edef_num, avg=1, measurements=1)
 		self.assertEqual(edef_obj.n_avg, num_avg)
 		self.assertEqual(edef_obj.n_measurements, num_meas)
-		current_name = epics.caget("EDEF:{sys}:{num}:NAME".format(sys=self.sys, num=self.edef_num))
+		current_name = caget_once(self.pv_prefix + "NAME")
 		self.assertEqual(current_name, self.name)
 		
 	def tearDown(self):
 		#Manually release the edef we reserved in setup.
 		if self.edef_num is not None:
-			epics.caput("EDEF:{sys}:{num}:FREE".format(sys=self.sys, num=self.edef_num), 1)		
+			epics.caput(self.pv_prefix + "FREE", 1)		
 
 class EdefReleaseTest(unittest.TestCase):
 	def setUp(self):
 		(self.sys, self.accelerator) = edef.get_system()
 		if self.accelerator == 'LCLS':
 			self.ioc_location = 'IN20'
-		self.edef = edef.EventDefinition("edef.py unit tests " + str(randint(0,255)), os.uname()[1])
+		self.edefs_available_pv = "IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location)
+		self.edef = edef.EventDefinition("edef.py unit tests " + unique_suffix(), HOSTNAME)
 	
 	def test_release(self):
-		edefs_available_before_release = epics.caget("IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.ioc_location))
+		edefs_available_before_release = caget_once(self.edefs_available_pv)
 		if not self.edef.is_reserved():
 			raise RuntimeError('EDEF could not be reserved, cannot proceed with test.')
 
 		self.edef.release()
-		edefs_available_after_release = epics.caget("IOC:{iocloc}:EV01:EDEFAVAIL".format(iocloc=self.edef.ioc_location))
+		edefs_available_after_release = caget_once(self.edefs_available_pv)
 		self.assertEqual(edefs_available_before_release, edefs_available_after_release - 1)
 
 	def tearDown(self):
@@ -90,46 +95,60 @@ class EdefReleaseTest(unittest.TestCase):
 			pass
 
 class EdefPropertiesTest(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		#These tests only change the edef's settings, so they can share one edef.
+		cls.edef = edef.EventDefinition("edef.py unit tests " + unique_suffix(), HOSTNAME)
+		#Connect to the PVs we check once, and reuse them in every assertion.
+		prefix = "EDEF:{sys}:{num}:".format(sys=cls.edef.sys, num=cls.edef.edef_num)
+		cls.pvs = {suffix: epics.get_pv(prefix + suffix, connect=False) for suffix in ("AVGCNT", "MEASCNT", "INCM1", "INCM2", "INCM1.DESC", "INCM2.DESC", "EXCM1", "EXCM2")}
+		epics.ca.poll()
+
 	def setUp(self):
-		self.edef = edef.EventDefinition("edef.py unit tests " + str(randint(0,255)), os.uname()[1])
+		#Put the shared edef back to its initial settings before each test.
+		self.edef.n_avg = 1
+		self.edef.n_measurements = -1
+		self.edef.clear_masks("INCLUSION")
+		self.edef.clear_masks("EXCLUSION")
 	
 	def test_n_avg(self):
 		n_avg = 5
 		self.edef.n_avg = n_avg
-		self.assertEqual(epics.caget("EDEF:{sys}:{num}:AVGCNT".format(sys=self.edef.sys, num=self.edef.edef_num)), n_avg)
+		self.assertEqual(self.pvs["AVGCNT"].get(use_monitor=False), n_avg)
 		self.assertEqual(self.edef.n_avg, n_avg)
 	
 	def test_n_measurements(self):
 		n_measurements = 10
 		self.edef.n_measurements = n_measurements
-		self.assertEqual(epics.caget("EDEF:{sys}:{num}:MEASCNT".format(sys=self.edef.sys, num=self.edef.edef_num)), n_measurements)
+		self.assertEqual(self.pvs["MEASCNT"].get(use_monitor=False), n_measurements)
 		self.assertEqual(self.edef.n_measurements, n_measurements)
 
 	def test_inclusion_masks(self):
 		self.assertTrue(self.edef.is_reserved())
-		mask_1 = epics.caget("EDEF:{sys}:{num}:INCM1.DESC".format(sys=self.edef.sys, num=self.edef.edef_num))
-		mask_2 = epics.caget("EDEF:{sys}:{num}:INCM2.DESC".format(sys=self.edef.sys, num=self.edef.edef_num))
+		mask_1 = self.pvs["INCM1.DESC"].get(use_monitor=False)
+		mask_2 = self.pvs["INCM2.DESC"].get(use_monitor=False)
 		masks = [mask_1, mask_2]
 		self.edef.inclusion_masks = masks
-		read_mask_1 = epics.caget("EDEF:{sys}:{num}:INCM1".format(sys=self.edef.sys, num=self.edef.edef_num))
-		read_mask_2 = epics.caget("EDEF:{sys}:{num}:INCM2".format(sys=self.edef.sys, num=self.edef.edef_num))
+		read_mask_1 = self.pvs["INCM1"].get(use_monitor=False)
+		read_mask_2 = self.pvs["INCM2"].get(use_monitor=False)
 		self.assertEqual(read_mask_1, 1)
 		self.assertEqual(read_mask_2, 1)
 	
 	def test_exclusion_masks(self):
 		self.assertTrue(self.edef.is_reserved())
-		mask_1 = epics.caget("EDEF:{sys}:{num}:INCM1.DESC".format(sys=self.edef.sys, num=self.edef.edef_num))
-		mask_2 = epics.caget("EDEF:{sys}:{num}:INCM2.DESC".format(sys=self.edef.sys, num=self.edef.edef_num))
+		mask_1 = self.pvs["INCM1.DESC"].get(use_monitor=False)
+		mask_2 = self.pvs["INCM2.DESC"].get(use_monitor=False)
 		masks = [mask_1, mask_2]
 		self.edef.exclusion_masks = masks
-		read_mask_1 = epics.caget("EDEF:{sys}:{num}:EXCM1".format(sys=self.edef.sys, num=self.edef.edef_num))
-		read_mask_2 = epics.caget("EDEF:{sys}:{num}:EXCM2".format(sys=self.edef.sys, num=self.edef.edef_num))
+		read_mask_1 = self.pvs["EXCM1"].get(use_monitor=False)
+		read_mask_2 = self.pvs["EXCM2"].get(use_monitor=False)
 		self.assertEqual(read_mask_1, 1)
 		self.assertEqual(read_mask_2, 1)
 
-	def tearDown(self):
+	@classmethod
+	def tearDownClass(cls):
 		try:
-			self.edef.release()
+			cls.edef.release()
 		except:
 			pass
 
@@ -137,7 +156,7 @@ class EdefPropertiesTest(unittest.TestCase):
 class AcquisitionTest(unittest.TestCase):
 	def setUp(self):
 		self.num_meas = 55
-		self.edef = edef.EventDefinition("edef.py unit tests " + str(randint(0,255)), user=os.uname()[1], avg=1, measurements=self.num_meas)
+		self.edef = edef.EventDefinition("edef.py unit tests " + unique_suffix(), user=HOSTNAME, avg=1, measurements=self.num_meas)
 		self.pv_list = ["BPMS:UNDH:{}90:X".format(num) for num in range(14,51)]
 
 	def test_single_acquisition(self):
@@ -145,13 +164,7 @@ class AcquisitionTest(unittest.TestCase):
 			print("Acquisition test only works on the LCLS network right now, skipping.")
 			return
 		self.edef.start()
-		timeout = 25.0
-		time_elapsed = 0.0
-		while not self.edef.is_acquisition_complete():
-			time_elapsed += 0.01
-			if time_elapsed > timeout:
-				raise RuntimeError("Timeout expired while acquiring edef data.")
-			time.sleep(0.01)
+		wait_for_completion(self.edef, timeout=25.0)
 		data = self.edef.get_buffer(self.pv_list[0])
 		self.assertEqual(len(data), self.num_meas)
 
@@ -160,13 +173,7 @@ class AcquisitionTest(unittest.TestCase):
 			print("Acquisition test only works on the LCLS network right now, skipping.")
 			return
 		self.edef.start()
-		timeout = 25.0
-		time_elapsed = 0.0
-		while not self.edef.is_acquisition_complete():
-			time_elapsed += 0.01
-			if time_elapsed > timeout:
-				raise RuntimeError("Timeout expired while acquiring edef data.")
-			time.sleep(0.01)
+		wait_for_completion(self.edef, timeout=25.0)
 		buffers = self.edef.get_buffer(self.pv_list)
 		self.assertEqual(len(buffers), len(self.pv_list))
 		for pv in buffers:
@@ -0,0 +1,73 @@
+#Helpers shared by the edef and sc_buffer test modules.
+import os
+import epics
+import time
+import itertools
+import threading
+
+#The user name for every reservation.  Look the hostname up once, not in every setUp.
+HOSTNAME = os.uname()[1]
+
+#Test names are made unique with the process id and a counter, so reruns don't collide.
+_name_counter = itertools.count()
+
+def setUpModule():
+    #Create the CA context before any test runs, and attach this thread to it, so
+    #every test shares one context.  pyepics finalizes it at exit.
+    epics.ca.use_initial_context()
+
+def unique_suffix():
+    return "{}_{}".format(os.getpid(), next(_name_counter))
+
+def caget_once(pv_name):
+    #These PVs are only read once or twice per test, so skip the monitor that
+    #caget would subscribe to, and just read the value.
+    return epics.get_pv(pv_name, auto_monitor=False).get(use_monitor=False)
+
+def wait_ready(pv_name, is_ready, timeout=2.0):
+    #Poll a PV until is_ready(value) is true.  Start at 10 ms and back off, so we
+    #don't always sleep a full second, but don't hammer the IOC either.
+    pv = epics.get_pv(pv_name, auto_monitor=False)
+    deadline = time.time() + timeout
+    delay = 0.01
+    while True:
+        value = pv.get(use_monitor=False, timeout=delay)
+        if value is not None and is_ready(value):
+            return True
+        if time.time() > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+def find_reserved_number(name_pvs, numbers, name, timeout=5.0):
+    #The IOC can take a moment to write a new reservation's NAME, so retry the batch
+    #read with the same back-off as wait_ready until the name shows up.
+    deadline = time.time() + timeout
+    delay = 0.01
+    while True:
+        names = epics.caget_many(name_pvs)
+        if name in names:
+            return numbers[names.index(name)]
+        if time.time() > deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+def wait_for_completion(edef_obj, timeout):
+    #wait_for_complete waits on a monitor of the CNT PV, so we don't poll here.
+    if not edef_obj.wait_for_complete(timeout=timeout):
+        raise RuntimeError("Timeout expired while acquiring edef data.")
+
+def wait_for_value(pv_name, expected, timeout=2.0):
+    #Wait for a monitor update with the value we expect, instead of sleeping a fixed time.
+    #The first monitor update carries the current value, so this returns right away
+    #if the PV already has it.
+    reached = threading.Event()
+    def check(value=None, **kw):
+        if value == expected:
+            reached.set()
+    pv = epics.PV(pv_name, auto_monitor=True, callback=check)
+    try:
+        return reached.wait(timeout)
+    finally:
+        pv.clear_callbacks()
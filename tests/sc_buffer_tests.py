@@ -1,24 +1,24 @@
 import unittest
 import edef
-import os
 import epics
 import time
 from random import randint
+from helpers import setUpModule, HOSTNAME, unique_suffix, caget_once, wait_ready, wait_for_completion, wait_for_value, find_reserved_number
 
 class EdefReservationTest(unittest.TestCase):
     def setUp(self):
         self.sys = "SYS0"
-        self.initial_edefs_available = epics.caget("BSA:SYS0:1:NFREEBSA")
-        self.name = "sc_buffer.py unit tests {}".format(randint(0,255))
-        self.edef = edef.BSABuffer(self.name, os.uname()[1])
+        self.initial_edefs_available = caget_once("BSA:SYS0:1:NFREEBSA")
+        self.name = "sc_buffer.py unit tests {}".format(unique_suffix())
+        self.edef = edef.BSABuffer(self.name, HOSTNAME)
 
     def test_available_count_drops(self):
-        edefs_available_after_setup = epics.caget("BSA:SYS0:1:NFREEBSA")
+        edefs_available_after_setup = caget_once("BSA:SYS0:1:NFREEBSA")
         self.assertTrue(edefs_available_after_setup < self.initial_edefs_available)
     
     def test_edef_name_is_correct(self):
         name_pv = "BSA:{sys}:1:{num}:NAME".format(sys=self.edef.sys, num=self.edef.number)
-        fetched_name = epics.caget(name_pv)
+        fetched_name = caget_once(name_pv)
         self.assertEqual(self.name, fetched_name)
 
     def tearDown(self):
@@ -32,17 +32,20 @@ class ExistingEdefTest(unittest.TestCase):
     def setUp(self):
         #Reserve an edef manually
         self.sys = "SYS0"
-        self.name = "sc_buffer.py unit tests {}".format(randint(0,255))
-        epics.caput("BSA:SYS0:1:BSANAME", self.name)
-        time.sleep(1.0)
+        self.name = "sc_buffer.py unit tests {}".format(unique_suffix())
+        initial_buffers_available = caget_once("BSA:SYS0:1:NFREEBSA")
+        epics.caput("BSA:SYS0:1:BSANAME", self.name, wait=True)
         #Find the number of the edef we just reserved
-        self.edef_num = None
-        for i in range(21,65):
-            name = epics.caget("BSA:{sys}:1:{num}:NAME".format(sys=self.sys, num=i))
-            if name == self.name:
-                self.edef_num = i
-                time.sleep(1.0) #Give the edef a bit of time to initialize.
-                break
+        #Read every buffer's name in one batch, rather than one caget per buffer.
+        buffer_nums = range(21,65)
+        sys_prefix = "BSA:{sys}:1:".format(sys=self.sys)
+        self.edef_num = find_reserved_number([sys_prefix + str(i) + ":NAME" for i in buffer_nums], buffer_nums, self.name)
+        if self.edef_num is not None:
+            self.pv_prefix = sys_prefix + str(self.edef_num) + ":"
+            #The IOC only counts the buffer as taken once it has set it up, so wait for
+            #the free count to drop before using it.
+            if not wait_ready("BSA:SYS0:1:NFREEBSA", lambda available: available < initial_buffers_available):
+                raise RuntimeError('Manually reserved buffer did not finish initializing, cannot proceed with test.')
         if self.edef_num is None:
             raise RuntimeError('Manual buffer reservation failed, cannot proceed with test.')
     
@@ -50,84 +53,96 @@ class ExistingEdefTest(unittest.TestCase):
         if self.edef_num is None:
             raise RuntimeError('Manual buffer reservation failed, cannot proceed with test.')
         num_avg = 13
-        epics.caput("BSA:{sys}:1:{num}:AVGCNT".format(sys=self.sys, num=self.edef_num), num_avg)
+        epics.caput(self.pv_prefix + "AVGCNT", num_avg, wait=True)
         num_meas = 20
-        epics.caput("BSA:{sys}:1:{num}:MEASCNT".format(sys=self.sys, num=self.edef_num), num_meas)
-        time.sleep(1.0)
+        epics.caput(self.pv_prefix + "MEASCNT", num_meas, wait=True)
         edef_obj = edef.BSABuffer("should ignore", number=self.edef_num, avg=1, measurements=1)
-        time.sleep(1.0)
         self.assertEqual(edef_obj.n_avg, num_avg)
         self.assertEqual(edef_obj.n_measurements, num_meas)
-        current_name = epics.caget("BSA:{sys}:1:{num}:NAME".format(sys=self.sys, num=self.edef_num))
+        current_name = caget_once(self.pv_prefix + "NAME")
         self.assertEqual(current_name, self.name)
         
     def tearDown(self):
         #Manually release the edef we reserved in setup.
         if self.edef_num is not None:
-            epics.caput("BSA:{sys}:1:{num}:FREE".format(sys=self.sys, num=self.edef_num), 1)
+            epics.caput(self.pv_prefix + "FREE", 1)
 
 class EdefReleaseTest(unittest.TestCase):
     def setUp(self):
-        self.edef = edef.BSABuffer("sc_buffer.py unit tests " + str(randint(0,255)), os.uname()[1])
+        self.edef = edef.BSABuffer("sc_buffer.py unit tests " + unique_suffix(), HOSTNAME)
     
     def test_release(self):
-        edefs_available_before_release = epics.caget("BSA:SYS0:1:NFREEBSA")
+        edefs_available_before_release = caget_once("BSA:SYS0:1:NFREEBSA")
         if not self.edef.is_reserved():
             raise RuntimeError('BSABuffer could not be reserved, cannot proceed with test.')
 
         self.edef.release()
-        time.sleep(1.0)
-        edefs_available_after_release = epics.caget("BSA:SYS0:1:NFREEBSA")
+        self.assertTrue(wait_for_value("BSA:SYS0:1:NFREEBSA", edefs_available_before_release + 1), "NFREEBSA never went back up after release")
+        edefs_available_after_release = caget_once("BSA:SYS0:1:NFREEBSA")
         self.assertEqual(edefs_available_before_release, edefs_available_after_release - 1)
 
     def tearDown(self):
         try: 
             self.edef.release()
         except Exception as e:
-            print("Exception encountered while releasing edef: {e}".format(e))
+            print("Exception encountered while releasing edef: {e}".format(e=e))
 
 class EdefPropertiesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        #These tests only change the buffer's settings, so they can share one buffer.
+        cls.edef = edef.BSABuffer("sc_buffer.py unit tests " + unique_suffix(), HOSTNAME)
+        #Connect to the PVs we check once, and reuse them in every assertion.
+        prefix = "BSA:{sys}:1:{num}:".format(sys=cls.edef.sys, num=cls.edef.number)
+        cls.pvs = {suffix: epics.get_pv(prefix + suffix, connect=False) for suffix in ("AVGCNT", "MEASCNT", "DST0", "DST1", "DST0.DESC", "DST1.DESC")}
+        epics.ca.poll()
+
     def setUp(self):
-        self.edef = edef.BSABuffer("sc_buffer.py unit tests " + str(randint(0,255)), os.uname()[1])
+        #Put the shared buffer back to its initial settings before each test.
+        self.edef.n_avg = 1
+        self.edef.n_measurements = 1000
+        self.edef.clear_masks()
     
     def test_n_avg(self):
         n_avg = 5
         self.edef.n_avg = n_avg
-        time.sleep(1.0)
-        self.assertEqual(epics.caget("BSA:{sys}:1:{num}:AVGCNT".format(sys=self.edef.sys, num=self.edef.number)), n_avg)
+        self.assertTrue(wait_for_value(self.pvs["AVGCNT"].pvname, n_avg), "AVGCNT never reached {}".format(n_avg))
+        self.assertEqual(self.pvs["AVGCNT"].get(use_monitor=False), n_avg)
         self.assertEqual(self.edef.n_avg, n_avg)
     
     def test_n_measurements(self):
         n_measurements = 10
         self.edef.n_measurements = n_measurements
-        time.sleep(1.0)
-        self.assertEqual(epics.caget("BSA:{sys}:1:{num}:MEASCNT".format(sys=self.edef.sys, num=self.edef.number)), n_measurements)
+        self.assertTrue(wait_for_value(self.pvs["MEASCNT"].pvname, n_measurements), "MEASCNT never reached {}".format(n_measurements))
+        self.assertEqual(self.pvs["MEASCNT"].get(use_monitor=False), n_measurements)
         self.assertEqual(self.edef.n_measurements, n_measurements)
 
     def test_destination_masks(self):
         return #Bug in BSA prevents us from properly testing this right now.
         self.assertTrue(self.edef.is_reserved())
-        mask_1 = epics.caget("BSA:{sys}:1:{num}:DST0.DESC".format(sys=self.edef.sys, num=self.edef.number))
-        mask_2 = epics.caget("BSA:{sys}:1:{num}:DST1.DESC".format(sys=self.edef.sys, num=self.edef.number))
+        mask_1 = self.pvs["DST0.DESC"].get(use_monitor=False)
+        mask_2 = self.pvs["DST1.DESC"].get(use_monitor=False)
         masks = [mask_1, mask_2]
         self.edef.destination_masks = masks
-        time.sleep(1.0)
-        read_mask_1 = epics.caget("BSA:{sys}:1:{num}:DST0".format(sys=self.edef.sys, num=self.edef.number))
-        read_mask_2 = epics.caget("BSA:{sys}:1:{num}:DST1".format(sys=self.edef.sys, num=self.edef.number))
+        self.assertTrue(wait_for_value(self.pvs["DST0"].pvname, 1), "DST0 never reached 1")
+        self.assertTrue(wait_for_value(self.pvs["DST1"].pvname, 1), "DST1 never reached 1")
+        read_mask_1 = self.pvs["DST0"].get(use_monitor=False)
+        read_mask_2 = self.pvs["DST1"].get(use_monitor=False)
         self.assertEqual(read_mask_1, 1)
         self.assertEqual(read_mask_2, 1)
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         try:
-            self.edef.release()
-        except:
-            print("Exception encountered while releasing edef: {e}".format(e))
+            cls.edef.release()
+        except Exception as e:
+            print("Exception encountered while releasing edef: {e}".format(e=e))
 
 
 class AcquisitionTest(unittest.TestCase):
     def setUp(self):
         self.num_meas = randint(0,1000)
-        self.edef = edef.BSABuffer("sc_buffer.py unit tests " + str(randint(0,255)), user=os.uname()[1], avg=1, measurements=self.num_meas)
+        self.edef = edef.BSABuffer("sc_buffer.py unit tests " + unique_suffix(), user=HOSTNAME, avg=1, measurements=self.num_meas)
         self.pv_list = ["BPMS:GUNB:314:X", "BPMS:HTR:120:X"]
 
     def test_single_acquisition(self):
@@ -136,13 +151,7 @@ class AcquisitionTest(unittest.TestCase):
             return
         self.edef.start()
         time.sleep(1.0)
-        timeout = 25.0
-        time_elapsed = 0.0
-        while not self.edef.is_acquisition_complete():
-            time_elapsed += 0.01
-            if time_elapsed > timeout:
-                raise RuntimeError("Timeout expired while acquiring edef data.")
-            time.sleep(0.01)
+        wait_for_completion(self.edef, timeout=25.0)
         data = self.edef.get_buffer(self.pv_list[0])
         self.assertEqual(len(data), self.num_meas)
 
@@ -152,13 +161,7 @@ class AcquisitionTest(unittest.TestCase):
             return
         self.edef.start()
         time.sleep(1.0)
-        timeout = 25.0
-        time_elapsed = 0.0
-        while not self.edef.is_acquisition_complete():
-            time_elapsed += 0.01
-            if time_elapsed > timeout:
-                raise RuntimeError("Timeout expired while acquiring edef data.")
-            time.sleep(0.01)
+        wait_for_completion(self.edef, timeout=25.0)
         buffers = self.edef.get_buffer(self.pv_list)
         self.assertEqual(len(buffers), len(self.pv_list))
         for pv in buffers: